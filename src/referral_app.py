@@ -1,56 +1,82 @@
 import os
+from pathlib import Path
 from dotenv import load_dotenv
-load_dotenv('../.env')
+load_dotenv(Path(__file__).resolve().parent.parent / '.env')
 
+import asyncio
 import json
-from typing import Dict, Any
+from typing import Dict, Any, List
 
 # Import utility classes
-from utils.supabase_client import SupabaseClient
-from utils.openai_client import OpenAIClient
-from utils.telnyx_client import TelnyxClient
+from utils.supabase_client import get_supabase_client
+from utils.openai_client import get_openai_client
+from utils.telnyx_client import get_telnyx_client
+from utils.message_filters import is_acknowledgement, is_declining
 
-def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+# how long a claimed message is left to its worker before a redelivery may take it over - the worker
+# timeout, so no live worker loses its claim and it has lapsed by the time SQS redelivers (360s)
+MESSAGE_CLAIM_LEASE_SECONDS = 300
+
+def worker_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
-    Main Lambda handler for referral assistant
+    SQS worker - processes queued tenant messages, reporting failed ones so only those are retried
     """
-    try:
-        # Parse the incoming webhook
-        body = json.loads(event.get('body', '{}'))
-        webhook_data = body.get('data', {})
-        
-        if webhook_data.get('event_type') != 'message.received':
-            return {'statusCode': 200, 'body': 'Event ignored'}
-        
-        # Extract message details
-        payload = webhook_data.get('payload', {})
-        from_number = payload.get('from', {}).get('phone_number')
-        message_text = payload.get('text')
-        
-        # Process the referral conversation
-        response = process_referral_conversation(from_number, message_text)
-        
-        return {
-            'statusCode': 200,
-            'body': json.dumps({'message': 'Referral processed', 'response': response})
-        }
-        
-    except Exception as e:
-        print(f"Error: {e}")
-        return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
+    records = event.get('Records', [])
+    supabase_client = get_supabase_client()
+    
+    async def process_all() -> List[str]:
+        failures = []
+        for index, record in enumerate(records):
+            # stop before Lambda times out - the rest go back on the queue
+            if context and context.get_remaining_time_in_millis() < 30000:
+                failures.extend(r.get('messageId') for r in records[index:])
+                break
+            
+            claimed_id = None
+            try:
+                message = json.loads(record['body'])
+                message_id = message.get('id')
+                
+                # Telnyx retries webhooks - claim the id first so only one delivery is ever processed
+                if message_id:
+                    claimed = await asyncio.to_thread(supabase_client.claim_message, message_id, MESSAGE_CLAIM_LEASE_SECONDS)
+                    if claimed is None:
+                        raise RuntimeError(f"Could not claim message {message_id}")
+                    if not claimed:
+                        print(f"Skipping already claimed message {message_id}")
+                        continue
+                    claimed_id = message_id
+                
+                response = await process_referral_conversation(message.get('from'), message.get('text') or '')
+            except Exception as e:
+                print(f"Failed to process record {record.get('messageId')}: {e}")
+                # let the redelivery claim it again
+                if claimed_id:
+                    await asyncio.to_thread(supabase_client.release_message, claimed_id)
+                failures.append(record.get('messageId'))
+                continue
+            
+            if claimed_id:
+                await asyncio.to_thread(supabase_client.complete_message, claimed_id)
+            print(f"Processed message from {message.get('from')}: {response}")
+        return failures
+    
+    failures = asyncio.run(process_all())
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failures]}
 
-def process_referral_conversation(tenant_phone: str, message: str) -> str:
+async def process_referral_conversation(tenant_phone: str, message: str) -> str:
     """
     Process a message from a tenant about referrals
+    (raises if the reply definitely wasn't sent, so the worker can retry the message)
     """
     try:
         # Initialize clients
-        supabase_client = SupabaseClient()
-        openai_client = OpenAIClient()
-        telnyx_client = TelnyxClient()
+        supabase_client = get_supabase_client()
+        openai_client = get_openai_client()
+        telnyx_client = get_telnyx_client()
         
         # Get tenant info
-        tenant = supabase_client.get_tenant_by_phone(tenant_phone)
+        tenant = await asyncio.to_thread(supabase_client.get_tenant_by_phone, tenant_phone)
         
         if not tenant:
             # Unknown tenant - might be a referral response
@@ -58,67 +84,48 @@ def process_referral_conversation(tenant_phone: str, message: str) -> str:
         
         # Check if tenant is declining
         if is_declining(message):
-            supabase_client.update_tenant_status(tenant_phone, "declined")
+            await asyncio.to_thread(supabase_client.update_tenant_status, tenant_phone, "declined")
             return "No worries! Thanks for letting me know. Have a great day!"
         
-        # Extract referral info from message
-        referral_info = openai_client.extract_referral_info(message)
-        
-        # If they provided referral info, add to leads
-        if referral_info:
-            for referral in referral_info:
-                supabase_client.create_referral_lead(referral, tenant_phone)
-        
-        # Generate response
-        ai_response = openai_client.generate_referral_response(tenant, message, referral_info)
-        
-        # Send response
-        telnyx_client.send_sms(tenant_phone, ai_response)
-        
-        # Update conversation history
-        supabase_client.add_tenant_message(tenant_phone, message, "tenant")
-        supabase_client.add_tenant_message(tenant_phone, ai_response, "ai")
+        if is_acknowledgement(message):
+            # Just "thanks!", "ok" etc. - only a short reply is needed
+            referral_info = []
+            ai_response = await asyncio.to_thread(openai_client.generate_referral_response, message)
+        else:
+            # Extract referral info and generate the reply in one OpenAI call
+            referral_info, ai_response = await asyncio.to_thread(openai_client.extract_and_respond, message)
+        
+        # Add leads and send response
+        _, sent = await asyncio.gather(
+            asyncio.to_thread(supabase_client.bulk_create_referral_leads, referral_info, tenant_phone),
+            asyncio.to_thread(telnyx_client.send_sms, tenant_phone, ai_response)
+        )
+        
+        if sent is False:
+            # never reached Telnyx - safe for SQS to redeliver and try again
+            raise RuntimeError(f"Failed to send reply to {tenant_phone}")
+        
+        # update conversation history (the reply only once we know it went out)
+        history = [(message, "tenant")]
+        if sent:
+            history.append((ai_response, "ai"))
+        else:
+            print(f"Reply to {tenant_phone} may not have been sent - not retrying so they aren't texted twice")
+        await asyncio.to_thread(supabase_client.add_tenant_messages, tenant_phone, history)
         
         return ai_response
         
     except Exception as e:
         print(f"Error processing referral: {e}")
-        return "Thanks for your message! I'll have our team follow up."
-
-def is_declining(message: str) -> bool:
-    """
-    Check if tenant is declining to provide referrals
-    """
-    message_lower = message.lower().strip()
-    
-    # Positive indicators (if these exist, probably not declining)
-    positive_indicators = [
-        'i know', 'yes', 'yeah', 'sure', 'friend', 'someone',
-        'looking', 'interested', 'might', 'could', 'name is',
-        'number is', 'phone', 'contact', 'email'
-    ]
-    
-    # Check for positive indicators first
-    for indicator in positive_indicators:
-        if indicator in message_lower:
-            return False
-    
-    # Decline patterns (only check if no positive indicators)
-    decline_patterns = [
-        'no', 'nope', 'not really', 'nobody', 'not interested',
-        'don\'t know anyone', 'dont know anyone', 'no one',
-        'not right now', 'not at the moment', 'can\'t think of anyone'
-    ]
-    
-    return any(pattern in message_lower for pattern in decline_patterns)
+        raise
 
 def send_referral_blast():
     """
     Send referral request to eligible tenants
     """
     try:
-        supabase_client = SupabaseClient()
-        telnyx_client = TelnyxClient()
+        supabase_client = get_supabase_client()
+        telnyx_client = get_telnyx_client()
         
         # get tenants that are elgiible for blast (they havent been contacted in 30 days)
         eligible_tenants = supabase_client.get_tenants_for_blast(days_since_last_contact = 30)
@@ -137,14 +144,12 @@ Just reply with their name and phone number, or let me know if you don't have an
         results = telnyx_client.send_referral_blast(tenant_numbers, blast_message)
         
         #update tenant status to contacted
-        for tenant in eligible_tenants:
-            supabase_client.update_tenant_status(tenant['phone'], "contacted")
-            supabase_client.add_tenant_message(tenant['phone'], blast_message, "ai")
-            
-            print(f"Blast sent to {len(eligible_tenants)} tenants")
-            print(f"Results: {results}")
-            
-            return results
+        supabase_client.mark_tenants_contacted(tenant_numbers, blast_message)
+        
+        print(f"Blast sent to {len(eligible_tenants)} tenants")
+        print(f"Results: {results}")
+        
+        return results
         
     except Exception as e:
         print(f"Error sending blast: {e}")
@@ -160,19 +165,17 @@ if __name__ == "__main__":
         print("Sending referral blast...")
         send_referral_blast()
         
-    # Test with a fake tenant response
+    # Test with a fake tenant response (as delivered to the worker by SQS)
     test_event = {
-        'body': json.dumps({
-            'data': {
-                'event_type': 'message.received',
-                'payload': {
-                    'from': {'phone_number': '+1555555555'},
-                    'text': 'Yeah, I know someone! My friend Sarah is looking for a place. Her number is 111-555-1234'
-                }
-            }
-        })
+        'Records': [{
+            'messageId': 'local-test',
+            'body': json.dumps({
+                'from': '+1555555555',
+                'text': 'Yeah, I know someone! My friend Sarah is looking for a place. Her number is 111-555-1234'
+            })
+        }]
     }
     
     print("Testing referral assistant...")
-    result = lambda_handler(test_event, None)
+    result = worker_handler(test_event, None)
     print(f"Result: {result}")
\ No newline at end of file
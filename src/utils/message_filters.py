@@ -0,0 +1,63 @@
+import re
+import ahocorasick
+
+# Positive indicators (if these exist, probably not declining)
+_POSITIVE_INDICATORS = [
+    'i know', 'yes', 'yeah', 'sure', 'friend', 'someone',
+    'looking', 'interested', 'might', 'could', 'name is',
+    'number is', 'phone', 'contact', 'email'
+]
+
+# Decline patterns (only matter if no positive indicators)
+_DECLINE_PATTERNS = [
+    'no', 'nope', 'not really', 'nobody', 'not interested',
+    'don\'t know anyone', 'dont know anyone', 'no one',
+    'not right now', 'not at the moment', 'can\'t think of anyone', 'cant think of anyone'
+]
+
+# Single automaton over both lists so a message is scanned once
+_INDICATOR_AUTOMATON = ahocorasick.Automaton()
+for _phrase in _POSITIVE_INDICATORS:
+    _INDICATOR_AUTOMATON.add_word(_phrase, ('pos', _phrase))
+for _phrase in _DECLINE_PATTERNS:
+    _INDICATOR_AUTOMATON.add_word(_phrase, ('neg', _phrase))
+_INDICATOR_AUTOMATON.make_automaton()
+
+_WORD_RE = re.compile(r"[a-z']+")
+
+# Everything in a reply like "ok thanks!" or "sounds good 👍" - a message made only of these has no referral in it
+_ACKNOWLEDGEMENT_WORDS = {
+    'thanks', 'thank', 'you', 'thx', 'ty', 'ok', 'okay', 'k', 'kk', 'cool', 'great', 'awesome',
+    'nice', 'perfect', 'sounds', 'good', 'got', 'it', 'will', 'do', 'np', 'alright', 'lol', 'haha'
+}
+_MAX_ACKNOWLEDGEMENT_WORDS = 4
+
+def is_declining(message: str) -> bool:
+    """
+    Check if tenant is declining to provide referrals
+    """
+    message_lower = message.lower().strip()
+    saw_decline = False
+    
+    for end, (kind, phrase) in _INDICATOR_AUTOMATON.iter(message_lower):
+        start = end - len(phrase) + 1
+        # only count whole-word matches ("no" shouldn't match inside "know")
+        if start > 0 and message_lower[start - 1].isalnum():
+            continue
+        if end + 1 < len(message_lower) and message_lower[end + 1].isalnum():
+            continue
+        
+        if kind == 'pos':
+            return False
+        saw_decline = True
+    
+    return saw_decline
+
+def is_acknowledgement(message: str) -> bool:
+    """
+    Check for a short acknowledgement ("thanks!", "ok cool") that can't contain a referral
+    """
+    if any(c.isdigit() for c in message) or '@' in message:
+        return False
+    words = _WORD_RE.findall(message.lower())
+    return 0 < len(words) <= _MAX_ACKNOWLEDGEMENT_WORDS and all(word in _ACKNOWLEDGEMENT_WORDS for word in words)
@@ -1,17 +1,80 @@
 import os
+import httpx
 import openai
-from typing import Dict, List, Optional
+from tenacity import retry_if_exception_type
+from utils.retry import external_call_retry
+from typing import Dict, List, Tuple
 import json
 import re
-from dotenv import load_dotenv
-from pathlib import Path
 
-# Load environment variables
-current_dir = Path(__file__).parent
-src_dir = current_dir.parent
-project_dir = src_dir.parent
-env_file = project_dir / '.env'
-load_dotenv(env_file)
+_PHONE_RE = re.compile(r'[^\d+]')
+
+_REFERRAL_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "phone": {"type": "string"},
+        "email": {"type": "string"},
+        "notes": {"type": "string"}
+    },
+    "required": ["name", "phone", "email", "notes"],
+    "additionalProperties": False
+}
+
+# Structured output schema - the API guarantees the reply matches it
+REFERRAL_REPLY_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "referrals_and_reply",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "referrals": {"type": "array", "items": _REFERRAL_ITEM_SCHEMA},
+                "reply": {"type": "string"}
+            },
+            "required": ["referrals", "reply"],
+            "additionalProperties": False
+        }
+    }
+}
+
+# System prompts are kept byte-identical across calls (the tenant's message goes in the user turn)
+# so OpenAI's prompt caching can reuse the prefix
+_EXTRACT_AND_RESPOND_SYSTEM = """You are a friendly AI assistant collecting referrals from current tenants for off-campus housing.
+
+1. Extract every potential referral the tenant mentions, with their name, phone number, email
+   and a short note on context. Use an empty string for anything not given.
+2. Write a brief, casual SMS reply using emojis appropriately:
+   - If they gave referrals, start by thanking them by name (e.g. "Perfect! Thanks for referring Sarah.")
+     and ask if they know anyone else who might be looking
+   - Otherwise acknowledge their message and ask for the name and phone number of anyone who might be looking
+   - If they seem hesitant, reassure them it's just to help their friends find housing
+
+The user message is the tenant's text.
+"""
+
+_REFERRAL_FOLLOWUP_SYSTEM = """You are a friendly AI assistant collecting referrals from current tenants for off-campus housing.
+
+Generate a conversational response that:
+- Acknowledges their message
+- Encourages them to share referral information if they haven't already
+- Asks for name and phone number of potential referrals
+- Keeps it casual and friendly
+- Uses emojis appropriately
+- If they seem hesitant, reassure them it's just to help their friends find housing
+
+The user message is the tenant's text.
+"""
+
+_instance = None
+
+def get_openai_client() -> "OpenAIClient":
+    """Get the shared OpenAIClient, creating it on first use so warm invocations reuse its connections"""
+    global _instance
+    if _instance is None:
+        _instance = OpenAIClient()
+    return _instance
 
 class OpenAIClient:
     def __init__(self):
@@ -19,133 +82,82 @@ class OpenAIClient:
         if not api_key:
             raise ValueError("Missing OPENAI_API_KEY environment variable")
         
-        self.client = openai.OpenAI(api_key=api_key)
+        # retries are handled once, by _create_completion, so the SDK's own retries are off
+        self.client = openai.OpenAI(api_key=api_key, timeout=httpx.Timeout(10.0, connect=3.0), max_retries=0)
         self.model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
         
-    def extract_referral_info(self, message: str) -> List[Dict]:
-        """Extract referral information from tenant messages"""
+    @external_call_retry(retry_if_exception_type((openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)))
+    def _create_completion(self, **kwargs):
+        """Create a chat completion, retrying on rate limits, timeouts and server errors"""
+        return self.client.chat.completions.create(**kwargs)
+    
+    def _clean_referrals(self, referral_info: List[Dict]) -> List[Dict]:
+        """Clean the referrals returned by the model"""
         
-        system_prompt = """You are extracting referral information from tenant messages.
-
-    Look for:
-    - Names of potential referrals
-    - Phone numbers  
-    - Email addresses
-
-    Extract referral information from this message: "{}"
-
-    IMPORTANT: Return ONLY a valid JSON array. No other text.
-
-    Format: [{{"name": "Name", "phone": "+1234567890", "email": "email@example.com", "notes": "context"}}]
-
-    If no referrals found, return: []
-
-    Examples:
-    Message: "My friend Sarah is looking for a place. Her number is 555-1234"
-    Response: [{{"name": "Sarah", "phone": "+15551234", "email": "", "notes": "friend of tenant"}}]
-
-    Message: "Nobody I can think of"
-    Response: []
-    """.format(message)
+        # Clean and validate referral info
+        cleaned_referrals = []
+        for referral in referral_info:
+            if referral.get('name') or referral.get('phone') or referral.get('email'):
+                # Clean phone number format
+                phone = referral.get('phone', '')
+                if phone:
+                    # Basic phone number cleaning
+                    phone = _PHONE_RE.sub('', phone)
+                    if phone and not phone.startswith('+'):
+                        phone = '+1' + phone.lstrip('1')
+                    referral['phone'] = phone
+                
+                cleaned_referrals.append(referral)
+        
+        return cleaned_referrals
+    
+    def extract_and_respond(self, incoming_message: str) -> Tuple[List[Dict], str]:
+        """Extract referral info and generate the conversational reply in a single call"""
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Extract referral info from: {message}"}
-                ],
-                max_tokens=300,
-                temperature=0.1
-            )
+            # sized for a few referrals plus the SMS reply; a long list can run past it - retry once with more room
+            # rather than losing both the referrals and the reply to a truncated JSON
+            for max_tokens in (300, 600):
+                response = self._create_completion(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": _EXTRACT_AND_RESPOND_SYSTEM},
+                        {"role": "user", "content": incoming_message}
+                    ],
+                    max_tokens=max_tokens,
+                    temperature=0.5,
+                    response_format=REFERRAL_REPLY_RESPONSE_FORMAT
+                )
+                if response.choices[0].finish_reason != "length":
+                    break
+                print(f"OpenAI response cut off at {max_tokens} tokens")
+            else:
+                raise ValueError("OpenAI response was cut off at the token limit")
             
             content = response.choices[0].message.content.strip()
             
             # Debug: print the raw response
             print(f"Raw OpenAI response: {content}")
             
-            # Try to parse JSON
-            try:
-                referral_info = json.loads(content)
-            except json.JSONDecodeError:
-                # If JSON parsing fails, try to extract JSON from the response
-                json_match = re.search(r'\[.*\]', content, re.DOTALL)
-                if json_match:
-                    referral_info = json.loads(json_match.group())
-                else:
-                    print(f"Could not parse JSON from: {content}")
-                    return []
-            
-            # Clean and validate referral info
-            cleaned_referrals = []
-            for referral in referral_info:
-                if referral.get('name') or referral.get('phone') or referral.get('email'):
-                    # Clean phone number format
-                    phone = referral.get('phone', '')
-                    if phone:
-                        # Basic phone number cleaning
-                        phone = re.sub(r'[^\d+]', '', phone)
-                        if phone and not phone.startswith('+'):
-                            phone = '+1' + phone.lstrip('1')
-                        referral['phone'] = phone
-                    
-                    cleaned_referrals.append(referral)
-            
-            return cleaned_referrals
+            result = json.loads(content)
+            return self._clean_referrals(result["referrals"]), result["reply"].strip()
         
         except Exception as e:
-            print(f"Error extracting referral info: {e}")
-            return []
+            print(f"Error extracting referral info and generating response: {e}")
+            return [], "Thanks for your message! Do you know anyone who might be looking for housing?"
     
-    def generate_referral_response(self, tenant_data: Dict, incoming_message: str, extracted_referrals: List[Dict] = None) -> str:
-        """Generate a conversational response for referral conversations"""
-        
-        tenant_status = tenant_data.get('status', 'active')
-        referrals_provided = tenant_data.get('referrals_provided', 0)
+    def generate_referral_response(self, incoming_message: str) -> str:
+        """Generate a conversational response for a message with no referrals in it"""
         
-        if extracted_referrals:
-            # Tenant just provided referral info
-            referral_names = [ref.get('name', 'someone') for ref in extracted_referrals]
-            
-            if len(referral_names) == 1:
-                acknowledgment = f"Perfect! Thanks for referring {referral_names[0]}."
-            else:
-                acknowledgment = f"Awesome! Thanks for referring {', '.join(referral_names)}."
-            
-            system_prompt = f"""You are a friendly AI assistant collecting referrals from current tenants.
-
-    The tenant just provided referral information. Generate a response that:
-    1. Thanks them for the referral(s)
-    2. Asks if they know anyone else who might be looking
-    3. Keeps it brief and friendly
-    4. Uses emojis appropriately
-
-    Start with: "{acknowledgment}"
-
-    The tenant just said: "{incoming_message}"
-    """
-        else:
-            # Regular conversation or follow-up
-            system_prompt = f"""You are a friendly AI assistant collecting referrals from current tenants for off-campus housing.
-
-    Generate a conversational response that:
-    - Acknowledges their message
-    - Encourages them to share referral information if they haven't already
-    - Asks for name and phone number of potential referrals
-    - Keeps it casual and friendly
-    - Uses emojis appropriately
-    - If they seem hesitant, reassure them it's just to help their friends find housing
-
-    The tenant just said: "{incoming_message}"
-    """
+        messages = [
+            {"role": "system", "content": _REFERRAL_FOLLOWUP_SYSTEM},
+            {"role": "user", "content": incoming_message}
+        ]
         
         try:
-            response = self.client.chat.completions.create(
+            response = self._create_completion(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": "Generate a friendly referral response."}
-                ],
+                messages=messages,
                 max_tokens=150,
                 temperature=0.7
             )
@@ -0,0 +1,39 @@
+import httpx
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+# statuses worth retrying - rate limited or a transient server error
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def external_call_retry(retry_on):
+    """
+    Retry policy shared by the API clients: up to 3 attempts with jittered exponential backoff,
+    re-raising the last error so callers' existing error handling still applies
+    """
+    return retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential_jitter(initial=0.5, max=8),
+        retry=retry_on,
+        reraise=True
+    )
+
+def is_retryable_http_error(error: BaseException) -> bool:
+    """
+    Timeouts/connection errors and 429/5xx responses from httpx (only safe for idempotent requests)
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, httpx.TransportError)
+
+retry_on_http_error = retry_if_exception(is_retryable_http_error)
+
+def retry_if_not_sent(status_codes=(429, 503)):
+    """
+    For non-idempotent requests: only retry when the request can't have been applied -
+    the connection never opened, or the server turned it away with one of status_codes.
+    Read timeouts and other 5xx are not retried since the server may already have acted on them.
+    """
+    def not_sent(error: BaseException) -> bool:
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in status_codes
+        return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+    return retry_if_exception(not_sent)
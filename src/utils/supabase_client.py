@@ -1,17 +1,23 @@
 import os
-from dotenv import load_dotenv
-from pathlib import Path
+import httpx
+from utils.retry import external_call_retry, retry_if_not_sent, retry_on_http_error
+from typing import Any, Dict, Optional, List, Tuple
+from datetime import datetime
 
-current_dir = Path(__file__).parent  # utils/
-src_dir = current_dir.parent         # src/
-project_dir = src_dir.parent         # project root
-env_file = project_dir / '.env'
+# columns needed on hot lookups (skips large history/chat columns)
+TENANT_COLUMNS = "phone,name,status,referrals_provided,last_contacted"
+LEAD_COLUMNS = "phone,name,email,referral_source"
 
-load_dotenv(env_file)
+_instance = None
 
-from supabase import create_client, Client
-from typing import Dict, Optional, List
-from datetime import datetime
+def get_supabase_client() -> "SupabaseClient":
+    """
+    Get the shared SupabaseClient, creating it on first use so warm invocations reuse its connections
+    """
+    global _instance
+    if _instance is None:
+        _instance = SupabaseClient()
+    return _instance
 
 class SupabaseClient:
     def __init__(self):
@@ -19,7 +25,88 @@ class SupabaseClient:
         key = os.getenv("SUPABASE_KEY")
         if not url or not key:
             raise ValueError("Missing SUPABASE_URL or SUPABASE_KEY environment variables")
-        self.client: Client = create_client(url, key)
+        # talk to PostgREST directly over one pooled HTTP/2 client so every call (and thread)
+        # reuses the same connection instead of paying a new TLS handshake
+        self.client = httpx.Client(
+            base_url=f"{url.rstrip('/')}/rest/v1",
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20),
+            timeout=httpx.Timeout(10.0, connect=3.0)
+        )
+    
+    # PostgREST helpers
+    def _request(self, method: str, path: str, params: Optional[Dict] = None, json: Any = None, prefer: str = "") -> httpx.Response:
+        """
+        Send a request to PostgREST, raising on error responses.
+        Reads retry on any transient error; writes/RPCs only when the request can't have been applied,
+        so a timed-out insert or increment is never run twice.
+        """
+        send = self._send_read if method in ("GET", "HEAD") else self._send_write
+        return send(method, path, params, json, prefer)
+    
+    @external_call_retry(retry_on_http_error)
+    def _send_read(self, method: str, path: str, params: Optional[Dict], json: Any, prefer: str) -> httpx.Response:
+        return self._send(method, path, params, json, prefer)
+    
+    @external_call_retry(retry_if_not_sent())
+    def _send_write(self, method: str, path: str, params: Optional[Dict], json: Any, prefer: str) -> httpx.Response:
+        return self._send(method, path, params, json, prefer)
+    
+    def _send(self, method: str, path: str, params: Optional[Dict], json: Any, prefer: str) -> httpx.Response:
+        headers = {"Prefer": prefer} if prefer else None
+        response = self.client.request(method, path, params=params, json=json, headers=headers)
+        response.raise_for_status()
+        return response
+    
+    def _select(self, table: str, params: Dict) -> List[Dict]:
+        """
+        Select rows from a table (params are PostgREST query params, e.g. {"phone": "eq.+1555"})
+        """
+        return self._request("GET", f"/{table}", params=params).json()
+    
+    def _select_one(self, table: str, columns: str, params: Dict) -> Optional[Dict]:
+        """
+        Select a single row, or None if nothing matches
+        """
+        rows = self._select(table, {"select": columns, **params, "limit": 1})
+        return rows[0] if rows else None
+    
+    def _insert(self, table: str, rows: Any, params: Optional[Dict] = None, prefer: str = "return=representation") -> List[Dict]:
+        """
+        Insert one row or a list of rows, returning the inserted rows
+        """
+        response = self._request("POST", f"/{table}", params=params, json=rows, prefer=prefer)
+        return response.json() if response.content else []
+    
+    def _update(self, table: str, updates: Dict, params: Dict) -> List[Dict]:
+        """
+        Update the rows matching params, returning the updated rows
+        """
+        return self._request("PATCH", f"/{table}", params=params, json=updates, prefer="return=representation").json()
+    
+    def _rpc(self, function: str, args: Dict) -> Any:
+        """
+        Call a Postgres function
+        """
+        response = self._request("POST", f"/rpc/{function}", json=args)
+        return response.json() if response.content else None
+    
+    @staticmethod
+    def _in(values: List[str]) -> str:
+        """
+        Build an in.(...) filter, quoting values so phone numbers with + etc. are safe
+        """
+        quoted = ",".join('"{}"'.format(value.replace('"', '\\"')) for value in values)
+        return f"in.({quoted})"
+    
+    @staticmethod
+    def _count(response: httpx.Response) -> Optional[int]:
+        """
+        Read the exact count from a Content-Range header (e.g. "0-24/3573" or "*/0")
+        """
+        total = response.headers.get("content-range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
         
     # tenant methods
     def get_tenant_by_phone(self, phone: str) -> Optional[Dict]:
@@ -27,10 +114,7 @@ class SupabaseClient:
         Get tenant by phone number
         """
         try:
-            response = self.client.table("tenants").select("*").eq("phone", phone).execute()
-            if response.data:
-                return response.data[0]
-            return None
+            return self._select_one("tenants", TENANT_COLUMNS, {"phone": f"eq.{phone}"})
         except Exception as e:
             print(f"Error getting tenant by phone: {e}")
             return None
@@ -49,9 +133,9 @@ class SupabaseClient:
                 "referrals_provided": 0,
                 "conversation_history": ""
             }
-            response = self.client.table("tenants").insert(tenant_data).execute()
-            if response.data:
-                return response.data[0]
+            rows = self._insert("tenants", tenant_data)
+            if rows:
+                return rows[0]
             return None
         except Exception as e:
             print(f"Error creating tenant: {e}")
@@ -66,41 +150,87 @@ class SupabaseClient:
                 "status": status,
                 "last_contacted": datetime.now().isoformat()
             }
-            response = self.client.table("tenants").update(updates).eq("phone", phone).execute()
-            return bool(response.data)
+            rows = self._update("tenants", updates, {"phone": f"eq.{phone}"})
+            return bool(rows)
         except Exception as e:
             print(f"Error updating tenant status: {e}")
             return False
+    
+    def mark_tenants_contacted(self, phones: List[str], blast_message: str) -> bool:
+        """
+        Mark a batch of tenants as contacted and log the blast message in one round trip
+        """
+        try:
+            self._rpc("mark_tenants_contacted", {
+                "phones": phones,
+                "blast_text": blast_message,
+                "ts": datetime.now().isoformat()
+            })
+            return True
+        except Exception as e:
+            print(f"Error marking tenants contacted: {e}")
+            return False
         
     def add_tenant_message(self, phone: str, message: str, sender: str = "tenant"):
         """
         Add a message to tenants conversation history
         """
+        self.add_tenant_messages(phone, [(message, sender)])
+    
+    def add_tenant_messages(self, phone: str, messages: List[Tuple[str, str]]):
+        """
+        Add several (message, sender) entries to tenants conversation history in one insert
+        """
         try: 
-            tenant = self.get_tenant_by_phone(phone)
-            if tenant:
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
-                existing_history = tenant.get("conversation_history", "")
-                sender_label = "Tenant" if sender == "tenant" else "AI"
-                new_entry = f"{timestamp} - {sender_label}: {message}\n"
-                
-                updated_history = existing_history + new_entry
-                
-                updates = {
-                    "conversation_history": updated_history,
-                    "last_contacted": datetime.now().isoformat()
-                }
-                self.client.table("tenants").update(updates).eq("phone", phone).execute()
+            rows = [
+                {"tenant_phone": phone, "sender": sender, "body": message}
+                for message, sender in messages
+            ]
+            self._insert("tenant_messages", rows, prefer="return=minimal")
         except Exception as e:
             print(f"Error adding tenant message: {e}")
             
+    def claim_message(self, message_id: str, lease_seconds: int) -> Optional[bool]:
+        """
+        Atomically claim a Telnyx message id for processing - False if it's already done or another
+        worker holds an unexpired claim, None if the claim couldn't be made
+        """
+        try:
+            return bool(self._rpc("claim_message", {"p_message_id": message_id, "lease_seconds": lease_seconds}))
+        except Exception as e:
+            print(f"Error claiming message: {e}")
+            return None
+    
+    def complete_message(self, message_id: str) -> bool:
+        """
+        Mark a claimed message id as handled, so later deliveries of it are skipped
+        """
+        try:
+            self._request("PATCH", "/processed_messages", params={"message_id": f"eq.{message_id}"},
+                          json={"status": "done"}, prefer="return=minimal")
+            return True
+        except Exception as e:
+            print(f"Error completing message: {e}")
+            return False
+    
+    def release_message(self, message_id: str) -> bool:
+        """
+        Drop the claim on a message that failed, so its redelivery can be processed
+        """
+        try:
+            self._request("DELETE", "/processed_messages",
+                          params={"message_id": f"eq.{message_id}", "status": "eq.processing"}, prefer="return=minimal")
+            return True
+        except Exception as e:
+            print(f"Error releasing message: {e}")
+            return False
+            
     def get_active_tenants(self) -> List[Dict]:
         """
         Get all active tenants for referral blasts
         """
         try:
-            response = self.client.table("tenants").select("*").eq("status", "active").execute()
-            return response.data or []
+            return self._select("tenants", {"select": TENANT_COLUMNS, "status": "eq.active"})
         except Exception as e:
             print(f"Error getting active tenants: {e}")
             return []
@@ -114,9 +244,11 @@ class SupabaseClient:
             from datetime import datetime, timedelta
             cutoff_date = datetime.now() - timedelta(days= days_since_last_contact)
             
-            response = self.client.table("tenants").select("*").eq("status", "active").or_(f"last_contacted.is.null,last_contacted.lt.{cutoff_date.isoformat()}"
-                                                                                            ).execute()
-            return response.data or []
+            return self._select("tenants", {
+                "select": TENANT_COLUMNS,
+                "status": "eq.active",
+                "or": f"(last_contacted.is.null,last_contacted.lt.{cutoff_date.isoformat()})"
+            })
         except Exception as e:
             print(f"Error getting tenants for blast: {e}")
             return []
@@ -126,16 +258,7 @@ class SupabaseClient:
         Increment the referral count for a tenant
         """
         try:
-            tenant = self.get_tenant_by_phone(phone)
-            if tenant:
-                current_count = tenant.get("referrals_provided", 0)
-                updates = {
-                    "referrals_provided": current_count + 1,
-                    "last_contacted": datetime.now().isoformat()
-                }
-                result = self.client.table("tenants").update(updates).eq("phone", phone).execute()
-                return bool(result.data)
-            return False
+            return bool(self._rpc("inc_referrals", {"p": phone}))
         except Exception as e:
             print(f"Error incrementing tenant referrals: {e}")
             return False
@@ -147,10 +270,7 @@ class SupabaseClient:
         Get lead record by phone number
         """
         try:
-            response = self.client.table("leads").select("*").eq("phone", phone).execute()
-            if response.data:
-                return response.data[0]
-            return None
+            return self._select_one("leads", LEAD_COLUMNS, {"phone": f"eq.{phone}"})
         except Exception as e:
             print(f"Error getting lead by phone: {e}")
             return None
@@ -170,37 +290,122 @@ class SupabaseClient:
                         'referral_source': f"Referred By {referring_tenant_phone}",
                         'name': referral_info.get('name', existing_lead.get('name', ''))
                     }
-                    self.client.table("leads").update(updates).eq("phone", referral_info['phone']).execute()
+                    self._update("leads", updates, {"phone": f"eq.{referral_info['phone']}"})
                 return existing_lead
             
             # create new lead with referral information
-            lead_data = {
-                "phone": referral_info.get('phone', ''),
-                "name": referral_info.get('name', ''),
-                "email": referral_info.get('email', ''),
-                "beds": "", 
-                "baths": "",
-                "move_in_date": "", 
-                "price": "",
-                "location": "",
-                "amenities": "",
-                "tour_availability": "",
-                "tour_ready": False,
-                "chat_history": f"Referral from {referring_tenant_phone}\n", 
-                "referral_source": f"Referred by {referring_tenant_phone}"
-            }
+            lead_data = self._referral_lead_data(referral_info, referring_tenant_phone)
             
-            response = self.client.table("leads").insert(lead_data).execute()
+            rows = self._insert("leads", lead_data)
             
-            if response.data:
+            if rows:
                 #increment referring tenant's referral count
                 self.increment_tenant_referrals(referring_tenant_phone)
-                return response.data[0]
+                return rows[0]
             return None
         except Exception as e:
             print(f"Error creating referral lead: {e}")
             return None
     
+    def bulk_create_referral_leads(self, referrals: List[Dict], referring_tenant_phone: str) -> List[Dict]:
+        """
+        Create leads for several referrals at once - one lookup, one insert and one count bump
+        regardless of how many referrals there are
+        """
+        try:
+            # one referral per phone number, or per email when they didn't give a phone
+            referrals_by_phone = {}
+            referrals_by_email = {}
+            for referral in referrals:
+                if referral.get('phone'):
+                    referrals_by_phone.setdefault(referral['phone'], referral)
+                elif referral.get('email'):
+                    referrals_by_email.setdefault(referral['email'], referral)
+                else:
+                    print(f"Skipping referral with no phone or email: {referral.get('name', '')}")
+            if not referrals_by_phone and not referrals_by_email:
+                return []
+            match = self._phone_or_email(list(referrals_by_phone), list(referrals_by_email))
+            
+            #check which leads already exist
+            existing = self._select("leads", {"select": "phone,email", "or": f"({match})"})
+            existing_phones = {lead['phone'] for lead in existing}
+            existing_emails = {lead['email'] for lead in existing}
+            
+            if existing:
+                #set the referral source on existing leads that don't have one yet
+                self._update(
+                    "leads",
+                    {'referral_source': f"Referred By {referring_tenant_phone}"},
+                    {"and": f"(or({match}),or(referral_source.is.null,referral_source.eq.))"}
+                )
+            
+            new_leads = [
+                self._referral_lead_data(referral, referring_tenant_phone)
+                for phone, referral in referrals_by_phone.items()
+                if phone not in existing_phones
+            ] + [
+                self._referral_lead_data(referral, referring_tenant_phone)
+                for email, referral in referrals_by_email.items()
+                if email not in existing_emails
+            ]
+            if not new_leads:
+                return []
+            
+            try:
+                created = self._insert("leads", new_leads)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 409:
+                    raise
+                # a lead was created concurrently since the lookup - insert one at a time, skipping it
+                # (leads_phone_idx is partial, so PostgREST can't upsert on_conflict=phone)
+                created = []
+                for lead in new_leads:
+                    try:
+                        created.extend(self._insert("leads", lead))
+                    except httpx.HTTPStatusError as e:
+                        if e.response.status_code != 409:
+                            raise
+            
+            if created:
+                #increment referring tenant's referral count
+                self._rpc("inc_referrals_by", {"p": referring_tenant_phone, "n": len(created)})
+            return created
+        except Exception as e:
+            print(f"Error bulk creating referral leads: {e}")
+            return []
+    
+    def _phone_or_email(self, phones: List[str], emails: List[str]) -> str:
+        """
+        Build the conditions for an or=(...) filter matching leads by any of the phones or emails
+        """
+        conditions = []
+        if phones:
+            conditions.append(f"phone.{self._in(phones)}")
+        if emails:
+            conditions.append(f"email.{self._in(emails)}")
+        return ",".join(conditions)
+    
+    def _referral_lead_data(self, referral_info: Dict, referring_tenant_phone: str) -> Dict:
+        """
+        Build a new lead record from referral information
+        """
+        return {
+            "phone": referral_info.get('phone', ''),
+            "name": referral_info.get('name', ''),
+            "email": referral_info.get('email', ''),
+            "beds": "", 
+            "baths": "",
+            "move_in_date": "", 
+            "price": "",
+            "location": "",
+            "amenities": "",
+            "tour_availability": "",
+            "tour_ready": False,
+            "chat_history": f"Referral from {referring_tenant_phone}\n", 
+            "referral_source": f"Referred by {referring_tenant_phone}"
+        }
+    
     def create_lead(self, phone: str, initial_message: str = "") -> Optional[Dict]:
         """
         Create a new lead record (for compatibility with agent 1)
@@ -225,9 +430,9 @@ class SupabaseClient:
                 "chat_history": initial_chat,
                 "referral_source": ""
             }
-            response = self.client.table("leads").insert(lead_data).execute()
-            if response.data:
-                return response.data[0]
+            rows = self._insert("leads", lead_data)
+            if rows:
+                return rows[0]
             return None
         except Exception as e:
             print(f"Error creating lead: {e}")
@@ -251,8 +456,8 @@ class SupabaseClient:
                     "conversation_history": ""
                 })
                 
-            response = self.client.table("tenants").insert(tenant_data).execute()
-            return bool(response.data)
+            rows = self._insert("tenants", tenant_data)
+            return bool(rows)
         except Exception as e:
             print(f"Error bulk creating tenants: {e}")
             return False
@@ -264,20 +469,26 @@ class SupabaseClient:
         """
         try:
             # get tenant stats
-            total_tenants = self.client.table("tenants").select("*", count ="exact").execute()
-            contacted_tenants = self.client.table("tenants").select("*", count ="exact").neq("last_contacted", None).execute()
+            # (HEAD requests - PostgREST only sends the count header, no rows)
+            total_tenants = self._request("HEAD", "/tenants", prefer="count=exact")
+            contacted_tenants = self._request("HEAD", "/tenants", params={"last_contacted": "not.is.null"}, prefer="count=exact")
             
             # get referral stats
-            total_referrals = self.client.table("leads").select("*", count ="exact").neq("referral_source", "").execute()
+            total_referrals = self._request("HEAD", "/leads", params={"referral_source": "neq."}, prefer="count=exact")
             
             # get top referring tenants
-            top_referrers = self.client.table("tenants").select("*").gt("referrals_provided", 0).order("referrals_provided", desc = True).limit(5).execute()
+            top_referrers = self._select("tenants", {
+                "select": "phone,name,referrals_provided",
+                "referrals_provided": "gt.0",
+                "order": "referrals_provided.desc",
+                "limit": 5
+            })
             
             return {
-                "total_tenants": total_tenants.count,
-                "contacted_tenants": contacted_tenants.count,
-                "total_referrals": total_referrals.count,
-                "top_referrers": top_referrers.data
+                "total_tenants": self._count(total_tenants),
+                "contacted_tenants": self._count(contacted_tenants),
+                "total_referrals": self._count(total_referrals),
+                "top_referrers": top_referrers
             }
         except Exception as e:
             print(f"Error getting referral stats: {e}")
@@ -1,55 +1,145 @@
 import os
+import asyncio
+import httpx
+import requests
 import telnyx
+from tenacity import retry_if_exception
+from urllib3.exceptions import NewConnectionError
+from utils.retry import external_call_retry, retry_if_not_sent
 from typing import Optional, List, Dict
-from dotenv import load_dotenv
-from pathlib import Path
 
-# Load environment variables
-current_dir = Path(__file__).parent
-src_dir = current_dir.parent
-project_dir = src_dir.parent
-env_file = project_dir / '.env'
-load_dotenv(env_file)
+TELNYX_MESSAGES_URL = "https://api.telnyx.com/v2/messages"
+TELNYX_TIMEOUT = 5
+
+def _is_unsent_telnyx_error(error: BaseException) -> bool:
+    """
+    Rate limited, or the connection to Telnyx never opened - the only SDK errors where resending
+    can't text the tenant twice (read timeouts and 5xx may already have been accepted)
+    """
+    if isinstance(error, telnyx.error.RateLimitError):
+        return True
+    if not isinstance(error, telnyx.error.APIConnectionError):
+        return False
+    # telnyx==2.0.0's RequestsClient._handle_request_error raises APIConnectionError inside the
+    # except block for the requests exception, so that exception is __context__ - recheck on an SDK upgrade
+    cause = error.__context__
+    if isinstance(cause, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(cause, requests.exceptions.ConnectionError) and cause.args:
+        return isinstance(getattr(cause.args[0], "reason", None), NewConnectionError)
+    return False
+
+_instance = None
+
+def get_telnyx_client() -> "TelnyxClient":
+    """Get the shared TelnyxClient, creating it on first use so warm invocations reuse it"""
+    global _instance
+    if _instance is None:
+        _instance = TelnyxClient()
+    return _instance
 
 class TelnyxClient:
+    # concurrent sends allowed at once (keeps us under Telnyx rate limits)
+    MAX_CONCURRENT_SENDS = 20
+    
     def __init__(self):
         api_key = os.getenv("TELNYX_API_KEY")
         if not api_key:
             raise ValueError("Missing TELNYX_API_KEY environment variable")
         
         telnyx.api_key = api_key
+        # the SDK has no per-request timeout, so swap in its default client with one -
+        # carrying over the module's proxy/SSL settings the SDK would otherwise have used
+        telnyx.default_http_client = telnyx.http_client.new_default_http_client(
+            verify_ssl_certs=telnyx.verify_ssl_certs,
+            proxy=telnyx.proxy,
+            timeout=TELNYX_TIMEOUT
+        )
+        self.api_key = api_key
         self.from_number = os.getenv("TELNYX_PHONE_NUMBER")
         if not self.from_number:
             raise ValueError("Missing TELNYX_PHONE_NUMBER environment variable")
     
-    def send_sms(self, to_number: str, message: str) -> bool:
-        """Send SMS message to a phone number"""
+    @external_call_retry(retry_if_exception(_is_unsent_telnyx_error))
+    def _create_message(self, to_number: str, message: str):
+        """Create a message through the Telnyx SDK, retrying only when it can't have been sent"""
+        return telnyx.Message.create(
+            from_=self.from_number,
+            to=to_number,
+            text=message
+        )
+    
+    def send_sms(self, to_number: str, message: str) -> Optional[bool]:
+        """
+        Send SMS message to a phone number - True if sent, False if it definitely wasn't (safe to resend),
+        None if it failed in a way where it may have gone out anyway (e.g. a read timeout)
+        """
         try:
-            response = telnyx.Message.create(
-                from_=self.from_number,
-                to=to_number,
-                text=message
-            )
+            response = self._create_message(to_number, message)
             
             print(f"SMS sent successfully to {to_number}: {response.id}")
             return True
             
+        except Exception as e:
+            print(f"Error sending SMS to {to_number}: {e}")
+            return False if _is_unsent_telnyx_error(e) else None
+    
+    @external_call_retry(retry_if_not_sent(status_codes=(429,)))
+    async def _post_message(self, client: httpx.AsyncClient, to_number: str, message: str, semaphore: asyncio.Semaphore) -> httpx.Response:
+        """POST one message to the Telnyx REST API (the semaphore is only held for the request, not the backoff)"""
+        async with semaphore:
+            response = await client.post(
+                TELNYX_MESSAGES_URL,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                json={"from": self.from_number, "to": to_number, "text": message}
+            )
+        response.raise_for_status()
+        return response
+    
+    async def send_sms_async(self, client: httpx.AsyncClient, to_number: str, message: str, semaphore: asyncio.Semaphore = None) -> bool:
+        """Send SMS message through the Telnyx REST API, retrying with backoff on connect failures/429"""
+        semaphore = semaphore or asyncio.Semaphore(self.MAX_CONCURRENT_SENDS)
+        
+        try:
+            response = await self._post_message(client, to_number, message, semaphore)
+            print(f"SMS sent successfully to {to_number}: {response.json()['data']['id']}")
+            return True
+            
         except Exception as e:
             print(f"Error sending SMS to {to_number}: {e}")
             return False
     
+    async def send_bulk_sms_async(self, numbers: List[str], message: str) -> List[bool]:
+        """Send the same SMS to many numbers concurrently"""
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_SENDS)
+        
+        async with httpx.AsyncClient(http2=True, limits=httpx.Limits(max_connections=50), timeout=TELNYX_TIMEOUT) as client:
+            results = await asyncio.gather(
+                *[self.send_sms_async(client, number, message, semaphore) for number in numbers],
+                return_exceptions=True
+            )
+        
+        return [result is True for result in results]
+    
+    async def send_referral_blast_async(self, tenant_numbers: List[str], message: str) -> Dict:
+        """Send referral blast to multiple tenants concurrently with detailed results"""
+        results = await self.send_bulk_sms_async(tenant_numbers, message)
+        successful_sends = sum(results)
+        
+        return {
+            'successful_sends': successful_sends,
+            'failed_sends': len(results) - successful_sends,
+            'total_tenants': len(tenant_numbers)
+        }
+    
     def send_group_sms(self, group_numbers: list, message: str) -> bool:
         """Send SMS message to multiple recipients (group chat)"""
         try:
             # For group messages, we need to send to all participants
-            # Telnyx doesn't have native group messaging, so we send individual messages
-            success_count = 0
-            
-            for number in group_numbers:
-                if self.send_sms(number, message):
-                    success_count += 1
+            # Telnyx doesn't have native group messaging, so we send individual messages concurrently
+            results = asyncio.run(self.send_bulk_sms_async(group_numbers, message))
             
-            return success_count > 0
+            return any(results)
             
         except Exception as e:
             print(f"Error sending group SMS: {e}")
@@ -57,17 +147,4 @@ class TelnyxClient:
         
     def send_referral_blast(self, tenant_numbers: List[str], message: str) -> Dict:
         """Send referral blast to multiple tenants with detailed results"""
-        successful_sends = 0
-        failed_sends = 0
-        
-        for number in tenant_numbers:
-            if self.send_sms(number, message):
-                successful_sends += 1
-            else:
-                failed_sends += 1
-        
-        return {
-            'successful_sends': successful_sends,
-            'failed_sends': failed_sends,
-            'total_tenants': len(tenant_numbers)
-        }
\ No newline at end of file
+        return asyncio.run(self.send_referral_blast_async(tenant_numbers, message))
@@ -0,0 +1,58 @@
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+load_dotenv(Path(__file__).resolve().parent.parent / '.env')
+
+import json
+import time
+import boto3
+from typing import Dict, Any
+
+# Kept apart from referral_app so the webhook Lambda doesn't import openai/telnyx/httpx on a cold start
+
+_sqs_client = None
+
+def get_sqs_client():
+    """
+    Get the shared SQS client, creating it on first use
+    """
+    global _sqs_client
+    if _sqs_client is None:
+        _sqs_client = boto3.client('sqs')
+    return _sqs_client
+
+def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Webhook handler - acknowledges Telnyx right away and queues the message for the worker
+    """
+    t0 = time.perf_counter()
+    try:
+        # Parse the incoming webhook
+        body = json.loads(event.get('body', '{}'))
+        webhook_data = body.get('data', {})
+        
+        if webhook_data.get('event_type') != 'message.received':
+            return {'statusCode': 200, 'body': 'Event ignored'}
+        
+        # Extract message details
+        payload = webhook_data.get('payload', {})
+        message_id = payload.get('id')
+        from_number = payload.get('from', {}).get('phone_number')
+        message_text = payload.get('text')
+        
+        if not message_text:
+            # e.g. an MMS with no text - nothing to process
+            return {'statusCode': 200, 'body': 'Event ignored'}
+        
+        # Hand off to the worker so Telnyx isn't kept waiting on Supabase/OpenAI
+        get_sqs_client().send_message(
+            QueueUrl=os.environ['REFERRAL_QUEUE_URL'],
+            MessageBody=json.dumps({'id': message_id, 'from': from_number, 'text': message_text})
+        )
+        
+        print(f"ack {time.perf_counter() - t0:.3f}s")
+        return {'statusCode': 200, 'body': json.dumps({'message': 'Referral queued'})}
+        
+    except Exception as e:
+        print(f"Error: {e}")
+        return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
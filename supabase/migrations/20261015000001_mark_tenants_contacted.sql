@@ -0,0 +1,13 @@
+-- Marks every tenant in a referral blast as contacted and logs the blast message
+-- in their conversation history, in a single statement.
+create or replace function mark_tenants_contacted(phones text[], blast_text text, ts timestamptz)
+returns void
+language sql
+as $$
+    update tenants
+    set status = 'contacted',
+        last_contacted = ts,
+        conversation_history = coalesce(conversation_history, '')
+            || to_char(ts, 'YYYY-MM-DD HH24:MI') || ' - AI: ' || blast_text || E'\n'
+    where phone = any(phones);
+$$;
@@ -0,0 +1,47 @@
+-- Append-only conversation log, replacing read-modify-write on tenants.conversation_history
+-- (the old column is left in place for existing transcripts).
+create table if not exists tenant_messages (
+    id bigint generated always as identity primary key,
+    tenant_phone text not null,
+    ts timestamptz not null default clock_timestamp(),
+    sender text not null,
+    body text not null
+);
+
+create index if not exists tenant_messages_phone_ts_idx on tenant_messages (tenant_phone, ts);
+
+-- Logging a message still counts as contacting the tenant
+create or replace function touch_tenant_last_contacted()
+returns trigger
+language plpgsql
+as $$
+begin
+    update tenants t
+    set last_contacted = i.ts
+    from (select tenant_phone, max(ts) as ts from inserted group by tenant_phone) i
+    where t.phone = i.tenant_phone;
+    return null;
+end;
+$$;
+
+drop trigger if exists tenant_messages_touch_tenant on tenant_messages;
+create trigger tenant_messages_touch_tenant
+    after insert on tenant_messages
+    referencing new table as inserted
+    for each statement
+    execute function touch_tenant_last_contacted();
+
+create or replace function mark_tenants_contacted(phones text[], blast_text text, ts timestamptz)
+returns void
+language sql
+as $$
+    update tenants
+    set status = 'contacted',
+        last_contacted = ts
+    where phone = any(phones);
+
+    insert into tenant_messages (tenant_phone, ts, sender, body)
+    select phone, ts, 'ai', blast_text
+    from tenants
+    where phone = any(phones);
+$$;
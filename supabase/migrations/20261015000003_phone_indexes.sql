@@ -0,0 +1,4 @@
+-- Phone is the lookup key for every webhook; index it (duplicate phones must be cleaned up first).
+-- Partial, so rows with no phone (e.g. a referral that only came with an email) don't collide on ''.
+create unique index if not exists tenants_phone_idx on tenants (phone) where phone <> '';
+create unique index if not exists leads_phone_idx on leads (phone) where phone <> '';
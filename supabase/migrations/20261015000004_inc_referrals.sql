@@ -0,0 +1,14 @@
+-- Atomic referral count bump; returns false if no tenant has that phone.
+create or replace function inc_referrals(p text)
+returns boolean
+language sql
+as $$
+    with updated as (
+        update tenants
+        set referrals_provided = coalesce(referrals_provided, 0) + 1,
+            last_contacted = now()
+        where phone = p
+        returning 1
+    )
+    select exists (select 1 from updated);
+$$;
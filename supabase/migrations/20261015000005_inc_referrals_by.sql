@@ -0,0 +1,14 @@
+-- Bump a tenant's referral count by n in one statement (bulk referral inserts).
+create or replace function inc_referrals_by(p text, n integer)
+returns boolean
+language sql
+as $$
+    with updated as (
+        update tenants
+        set referrals_provided = coalesce(referrals_provided, 0) + n,
+            last_contacted = now()
+        where phone = p
+        returning 1
+    )
+    select exists (select 1 from updated);
+$$;
@@ -0,0 +1,5 @@
+-- Telnyx message ids already handled by the worker, so webhook retries are only processed once.
+create table if not exists processed_messages (
+    message_id text primary key,
+    ts timestamptz not null default now()
+);
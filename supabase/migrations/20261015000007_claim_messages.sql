@@ -0,0 +1,22 @@
+-- Claim a message id before it's processed so concurrent deliveries of the same webhook can't both reply.
+-- A claim still 'processing' after its lease (the worker died mid-message) can be taken over.
+alter table processed_messages
+    add column if not exists status text not null default 'done',
+    add column if not exists claimed_at timestamptz not null default now();
+
+-- True if this call now holds the claim; false if another worker holds it or the message is done.
+create or replace function claim_message(p_message_id text, lease_seconds integer)
+returns boolean
+language sql
+as $$
+    with claimed as (
+        insert into processed_messages (message_id, status, claimed_at)
+        values (p_message_id, 'processing', now())
+        on conflict (message_id) do update
+        set claimed_at = now()
+        where processed_messages.status = 'processing'
+          and processed_messages.claimed_at < now() - make_interval(secs => lease_seconds)
+        returning 1
+    )
+    select exists (select 1 from claimed);
+$$;
@@ -0,0 +1,50 @@
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from utils.message_filters import is_acknowledgement, is_declining
+
+
+class IsDecliningTest(unittest.TestCase):
+    def test_declines(self):
+        for message in ["No", "nope, sorry", "Not right now", "I don't know anyone", "cant think of anyone"]:
+            self.assertTrue(is_declining(message), message)
+
+    def test_positive_indicator_wins(self):
+        self.assertFalse(is_declining("No but my friend Sarah is looking"))
+        self.assertFalse(is_declining("not sure, maybe someone from class"))
+
+    def test_whole_words_only(self):
+        # "no" inside "know" or "Nolan" shouldn't count
+        self.assertFalse(is_declining("I know Sarah"))
+        self.assertFalse(is_declining("Tell Nolan to text you"))
+
+    def test_plain_message(self):
+        self.assertFalse(is_declining("Sarah 555-111-2222"))
+        self.assertFalse(is_declining(""))
+
+
+class IsAcknowledgementTest(unittest.TestCase):
+    def test_acknowledgements(self):
+        for message in ["Thanks!", "ok", "Ok cool 👍", "Thank you", "sounds good", "Will do!"]:
+            self.assertTrue(is_acknowledgement(message), message)
+
+    def test_names(self):
+        # lowercase names and names that are also common words still go to extraction
+        for message in ["sarah", "ask will", "Will Smith", "thanks, try jake"]:
+            self.assertFalse(is_acknowledgement(message), message)
+
+    def test_contact_details(self):
+        self.assertFalse(is_acknowledgement("ok 555-111-2222"))
+        self.assertFalse(is_acknowledgement("ok sam@example.com"))
+
+    def test_long_or_empty(self):
+        self.assertFalse(is_acknowledgement("ok ok ok ok ok"))
+        self.assertFalse(is_acknowledgement("👍"))
+        self.assertFalse(is_acknowledgement(""))
+
+
+if __name__ == '__main__':
+    unittest.main()